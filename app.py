@@ -2,7 +2,10 @@ from flask import Flask
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
 from models import db, User
+from stores import DEFAULT_STORE, store_binds, current_store, init_stores
+from security import init_security
 from werkzeug.security import generate_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import datetime
 
 app = Flask(
@@ -16,8 +19,41 @@ app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///coffeehouse.db"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 app.config["WTF_CSRF_ENABLED"] = True
 
+# Branches: code -> display name, e.g. "harbour": "Harbour Road". Each branch
+# keeps its orders in its own SQLite file, store_<code>.db.
+app.config["STORES"] = {
+    DEFAULT_STORE: "Main Street",
+}
+app.config["DEFAULT_STORE"] = DEFAULT_STORE
+app.config["SQLALCHEMY_BINDS"] = store_binds(app.config["STORES"])
+
+# Password hashing. Stored hashes using other parameters are upgraded on the
+# user's next successful login, e.g. "pbkdf2:sha256:600000".
+app.config["PASSWORD_HASH_METHOD"] = "scrypt:32768:8:1"
+app.config["PASSWORD_HASH_WORKERS"] = 2
+app.config["PASSWORD_HASH_QUEUE"] = 8
+
+# Login throttling: burst size and refill rate (tokens per second)
+app.config["LOGIN_USER_BURST"] = 5
+app.config["LOGIN_USER_RATE"] = 1 / 30
+app.config["LOGIN_IP_BURST"] = 30
+app.config["LOGIN_IP_RATE"] = 1
+
+# Number of reverse proxies in front of the app whose X-Forwarded-For header
+# is trusted. Without it every client shares the proxy's address, and the
+# per-IP login throttle becomes one global bucket. Set to 0 when serving
+# directly, so clients cannot spoof their address.
+app.config["TRUSTED_PROXIES"] = 1
+if app.config["TRUSTED_PROXIES"]:
+    app.wsgi_app = ProxyFix(
+        app.wsgi_app,
+        x_for=app.config["TRUSTED_PROXIES"],
+        x_proto=app.config["TRUSTED_PROXIES"]
+    )
+
 csrf = CSRFProtect(app)
 db.init_app(app)
+init_security(app)
 
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -26,10 +62,15 @@ login_manager.login_view = "login"
 # Add global template context
 @app.context_processor
 def inject_now():
-    return {'now': datetime.now()}
+    return {
+        'now': datetime.now(),
+        'stores': app.config["STORES"],
+        'current_store': current_store()
+    }
 
 with app.app_context():
-    db.create_all()
+    # Shared tables go in the primary database, orders in each store's file
+    init_stores(app, db)
     
     # Initialize default admin user if no users exist
     if User.query.count() == 0:
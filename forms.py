@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, SubmitField, FloatField, TextAreaField, SelectField, BooleanField, IntegerField, DateField, SelectMultipleField
+from wtforms import StringField, PasswordField, SubmitField, FloatField, TextAreaField, SelectField, BooleanField, IntegerField, DateField, SelectMultipleField, HiddenField
 from wtforms.validators import DataRequired, Email, Length, NumberRange
 
 class LoginForm(FlaskForm):
@@ -11,6 +11,7 @@ class OrderForm(FlaskForm):
     customer_name = StringField('Customer Name', validators=[DataRequired()])
     menu_items = SelectMultipleField('Menu Items', validators=[DataRequired()], coerce=int)
     staff_id = SelectField('Staff Member', validators=[DataRequired()], coerce=int)
+    client_key = HiddenField()
     submit = SubmitField('Create Order')
 
 class MenuItemForm(FlaskForm):
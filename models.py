@@ -1,15 +1,17 @@
+from flask import current_app
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import random
 
+from stores import StoreSession, DEFAULT_STORE
+
 # --- FIX: Define DB here to prevent circular imports ---
 class Base(DeclarativeBase):
     pass
 
-db = SQLAlchemy(model_class=Base)
+db = SQLAlchemy(model_class=Base, session_options={"class_": StoreSession})
 # -----------------------------------------------------
 
 class User(UserMixin, db.Model):
@@ -20,10 +22,7 @@ class User(UserMixin, db.Model):
     role = db.Column(db.String(20), nullable=False, default='staff')
     
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
-    
-    def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        self.password_hash = current_app.extensions["password_verifier"].hash(password)
 
 class MenuItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -42,6 +41,7 @@ class Staff(db.Model):
     position = db.Column(db.String(50), nullable=False)
     contact = db.Column(db.String(50))
     active = db.Column(db.Boolean, default=True)
+    store = db.Column(db.String(20), nullable=False, default=DEFAULT_STORE)
     orders = db.relationship('Order', backref='staff_member', lazy=True)
     
     def __init__(self, **kwargs):
@@ -56,6 +56,7 @@ class Order(db.Model):
     timestamp = db.Column(db.DateTime, default=datetime.now)
     status = db.Column(db.String(20), default='Pending')
     total = db.Column(db.Float, default=0.0)
+    client_key = db.Column(db.String(36), unique=True, index=True)
     items = db.relationship('OrderItem', backref='order', lazy=True, cascade="all, delete-orphan")
 
 class OrderItem(db.Model):
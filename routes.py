@@ -1,11 +1,19 @@
-from flask import render_template, redirect, url_for, flash, request, jsonify
+from flask import render_template, redirect, url_for, flash, request, jsonify, session, current_app, g
+from flask_wtf.csrf import generate_csrf
 from flask_login import login_user, logout_user, login_required, current_user
 from datetime import datetime
 from functools import wraps
+from collections import Counter
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
 import random
 
 from models import db, User, MenuItem, Staff, Order, OrderItem, AuditLog
 from forms import LoginForm, OrderForm, MenuItemForm, StaffForm, UserForm
+from stores import current_store, for_each_store
+
+# Largest batch of queued offline orders accepted by one sync request
+MAX_SYNC_BATCH = 100
 
 def register_routes(app, login_manager):
     """Register all routes for the application"""
@@ -43,6 +51,107 @@ def register_routes(app, login_manager):
             "counts": [42, 30, 25]
         }
     
+    def store_totals(code):
+        """Order count and revenue for one branch"""
+        count, revenue = db.session.query(
+            func.count(Order.id), func.coalesce(func.sum(Order.total), 0.0)
+        ).one()
+        return {'count': count, 'revenue': revenue}
+
+    def store_report(code):
+        """Partial report aggregates for one branch, merged by reports()"""
+        by_status = dict(
+            db.session.query(Order.status, func.count(Order.id)).group_by(Order.status).all()
+        )
+        by_staff = db.session.query(
+            Order.staff_id, func.count(Order.id), func.sum(Order.total)
+        ).group_by(Order.staff_id).all()
+        by_item = db.session.query(
+            OrderItem.menu_item_id, func.sum(OrderItem.quantity)
+        ).group_by(OrderItem.menu_item_id).all()
+        return {
+            'totals': store_totals(code),
+            'by_status': by_status,
+            'staff_counts': {staff_id: count for staff_id, count, _ in by_staff},
+            'staff_totals': {staff_id: total for staff_id, _, total in by_staff},
+            'item_counts': dict(by_item)
+        }
+    
+    def build_order(customer_name, staff_id, menu_items, client_key=None, timestamp=None):
+        """Create a pending Order with one OrderItem per menu item"""
+        return Order(
+            customer_name=customer_name,
+            staff_id=staff_id,
+            timestamp=timestamp or datetime.now(),
+            status="Pending",
+            total=sum(i.price for i in menu_items),
+            client_key=client_key or None,
+            items=[OrderItem(menu_item_id=i.id, quantity=1) for i in menu_items]
+        )
+
+    def apply_order_batch(batch):
+        """Insert queued offline orders, skipping keys that were already synced"""
+        keys = [e.get("client_key") for e in batch if isinstance(e.get("client_key"), str)]
+        existing = dict(
+            db.session.query(Order.client_key, Order.id).filter(Order.client_key.in_(keys)).all()
+        )
+        item_ids, staff_ids = set(), set()
+        for entry in batch:
+            try:
+                if isinstance(entry.get("menu_items"), list):
+                    item_ids.update(int(i) for i in entry["menu_items"])
+                staff_ids.add(int(entry.get("staff_id")))
+            except (TypeError, ValueError):
+                pass
+        # Accept only what the /orders form would offer in this store
+        menu = {m.id: m for m in MenuItem.query.filter(MenuItem.id.in_(item_ids), MenuItem.available).all()}
+        known_staff = {
+            s.id for s in Staff.query.filter(
+                Staff.id.in_(staff_ids), Staff.active, Staff.store == current_store()
+            ).all()
+        }
+
+        results, created = {}, {}
+        for entry in batch:
+            key = entry.get("client_key")
+            if not isinstance(key, str) or not 0 < len(key) <= 36:
+                continue
+            if key in existing:
+                results[key] = {"status": "duplicate", "id": existing[key]}
+                continue
+            if key in created:
+                continue
+            items = entry.get("menu_items")
+            try:
+                staff_id = int(entry.get("staff_id"))
+                selected = [menu.get(int(i)) for i in items] if isinstance(items, list) else []
+            except (TypeError, ValueError):
+                staff_id, selected = None, []
+            try:
+                timestamp = datetime.fromtimestamp(int(entry["created_at"]) / 1000)
+            except (KeyError, TypeError, ValueError, OverflowError, OSError):
+                timestamp = None
+            customer_name = entry.get("customer_name")
+            customer_name = customer_name.strip() if isinstance(customer_name, str) else ""
+            # Like the form, reject the whole order if any item is unknown or unavailable
+            reason = None
+            if not 0 < len(customer_name) <= Order.customer_name.type.length:
+                reason = "Customer name is missing or too long"
+            elif staff_id not in known_staff:
+                reason = "Staff member is not active in this store"
+            elif not selected or None in selected:
+                reason = "An item is no longer available"
+            if reason:
+                results[key] = {"status": "invalid", "reason": reason}
+                continue
+            created[key] = build_order(customer_name, staff_id, selected, key, timestamp)
+
+        db.session.add_all(created.values())
+        db.session.flush()
+        for key, order in created.items():
+            results[key] = {"status": "created", "id": order.id}
+        return results
+    
     # ---------------- LOGIN LOADER ----------------
     @login_manager.user_loader
     def load_user(user_id):
@@ -59,8 +168,27 @@ def register_routes(app, login_manager):
     def login():
         form = LoginForm()
         if form.validate_on_submit():
+            throttle = current_app.extensions["login_throttle"]
+            user_key = form.username.data.lower()
+            if not (throttle["ip"].consume(request.remote_addr) and throttle["user"].consume(user_key)):
+                flash("Too many login attempts. Please wait and try again.", "danger")
+                return render_template("login.html", form=form), 429
+
             user = User.query.filter_by(username=form.username.data).first()
-            if user and user.check_password(form.password.data):
+            result = (False, None)
+            if user and user.password_hash:
+                result = current_app.extensions["password_verifier"].verify(user.password_hash, form.password.data)
+                if result is None:
+                    flash("Server busy. Please try again in a moment.", "danger")
+                    return render_template("login.html", form=form), 503
+
+            ok, new_hash = result
+            if ok:
+                if new_hash:
+                    user.password_hash = new_hash
+                    db.session.commit()
+                throttle["ip"].refund(request.remote_addr)
+                throttle["user"].refund(user_key)
                 login_user(user)
                 flash("Login successful!", "success")
                 return redirect(url_for("dashboard"))
@@ -74,13 +202,24 @@ def register_routes(app, login_manager):
         flash("Logged out successfully", "success")
         return redirect(url_for("login"))
 
+    @app.route("/store/select", methods=["POST"])
+    @login_required
+    def select_store():
+        code = request.form.get("store")
+        if code in current_app.config["STORES"]:
+            session["store"] = code
+            flash(f"Switched to {current_app.config['STORES'][code]}", "success")
+        else:
+            flash("Unknown store", "danger")
+        return redirect(request.referrer or url_for("dashboard"))
+
     # -------- DASHBOARD --------
     @app.route("/dashboard")
     @login_required
     def dashboard():
-        orders = Order.query.all()
-        total_orders = len(orders)
-        total_sales = sum(order.total for order in orders)
+        totals = for_each_store(store_totals)
+        total_orders = sum(t['count'] for t in totals.values())
+        total_sales = sum(t['revenue'] for t in totals.values())
         active_staff = Staff.query.filter_by(active=True).count()
 
         daily_sales = get_daily_sales()
@@ -101,36 +240,65 @@ def register_routes(app, login_manager):
     def orders():
         form = OrderForm()
         menu_items = MenuItem.query.filter_by(available=True).all()
-        staff_members = Staff.query.filter_by(active=True).all()
+        staff_members = Staff.query.filter_by(active=True, store=current_store()).all()
 
         form.menu_items.choices = [(i.id, f"{i.name} - ₹{i.price}") for i in menu_items]
         form.staff_id.choices = [(s.id, s.name) for s in staff_members]
 
         if form.validate_on_submit():
-            selected_items = MenuItem.query.filter(MenuItem.id.in_(form.menu_items.data)).all()
-            total = sum(i.price for i in selected_items)
-
-            order = Order(
-                customer_name=form.customer_name.data,
-                staff_id=form.staff_id.data,
-                timestamp=datetime.now(),
-                status="Pending",
-                total=total
-            )
+            client_key = form.client_key.data or None
+            if client_key and Order.query.filter_by(client_key=client_key).first():
+                flash("Order already recorded", "info")
+                return redirect(url_for("orders"))
 
+            selected_items = MenuItem.query.filter(MenuItem.id.in_(form.menu_items.data)).all()
+            order = build_order(form.customer_name.data, form.staff_id.data, selected_items, client_key)
             db.session.add(order)
-            db.session.flush()
-
-            for item in selected_items:
-                db.session.add(OrderItem(order_id=order.id, menu_item_id=item.id, quantity=1))
-
-            db.session.commit()
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # A concurrent submit with the same key won the race
+                db.session.rollback()
+                flash("Order already recorded", "info")
+                return redirect(url_for("orders"))
             flash("Order added successfully", "success")
             return redirect(url_for("orders"))
 
         orders_list = Order.query.order_by(Order.timestamp.desc()).all()
         return render_template("orders.html", orders=orders_list, form=form)
 
+    @app.route("/api/orders/sync", methods=["POST"])
+    @login_required
+    def sync_orders():
+        payload = request.get_json(silent=True) or {}
+        batch = payload.get("orders")
+        if not isinstance(batch, list) or not all(isinstance(e, dict) for e in batch):
+            return jsonify({"error": "orders must be a list"}), 400
+        if len(batch) > MAX_SYNC_BATCH:
+            return jsonify({"error": f"at most {MAX_SYNC_BATCH} orders per request"}), 413
+
+        # Queued orders belong to the store they were taken in
+        if payload.get("store") not in current_app.config["STORES"]:
+            return jsonify({"error": "unknown store"}), 400
+        g.store = payload["store"]
+
+        for attempt in range(2):
+            try:
+                results = apply_order_batch(batch)
+                db.session.commit()
+                break
+            except IntegrityError:
+                # Another sync inserted some of these keys first; retry sees them as duplicates
+                db.session.rollback()
+                if attempt:
+                    raise
+        return jsonify({"results": results})
+
+    @app.route("/api/csrf_token")
+    @login_required
+    def refresh_csrf_token():
+        return jsonify({"csrf_token": generate_csrf()})
+
     @app.route("/order/update_status/<int:id>", methods=["POST"])
     @login_required
     @require_role("admin", "manager")
@@ -142,7 +310,7 @@ def register_routes(app, login_manager):
         if new_status in ["Pending", "In Progress", "Completed", "Cancelled"]:
             order.status = new_status
             db.session.commit()
-            log_action("UPDATE_ORDER_STATUS", f"Order #{order.id}: {old_status} → {new_status}")
+            log_action("UPDATE_ORDER_STATUS", f"Order #{order.id} ({current_store()}): {old_status} → {new_status}")
             flash(f"Order status updated to {new_status}", "success")
         
         return redirect(url_for("orders"))
@@ -155,7 +323,7 @@ def register_routes(app, login_manager):
         order_id = order.id
         db.session.delete(order)
         db.session.commit()
-        log_action("DELETE_ORDER", f"Deleted order #{order_id}")
+        log_action("DELETE_ORDER", f"Deleted order #{order_id} ({current_store()})")
         flash("Order removed", "success")
         return redirect(url_for("orders"))
 
@@ -237,39 +405,43 @@ def register_routes(app, login_manager):
     @app.route("/reports")
     @login_required
     def reports():
-        orders = Order.query.all()
-        total_revenue = sum(order.total for order in orders)
-        total_orders_count = len(orders)
-        
-        # Get orders by status
-        pending_orders = len([o for o in orders if o.status == "Pending"])
-        completed_orders = len([o for o in orders if o.status == "Completed"])
+        partials = for_each_store(store_report)
+
+        # Merge the per-branch aggregates
+        by_status, staff_counts, staff_totals, item_counts = Counter(), Counter(), Counter(), Counter()
+        for part in partials.values():
+            by_status.update(part['by_status'])
+            staff_counts.update(part['staff_counts'])
+            staff_totals.update(part['staff_totals'])
+            item_counts.update(part['item_counts'])
+
+        total_revenue = sum(p['totals']['revenue'] for p in partials.values())
+        total_orders_count = sum(p['totals']['count'] for p in partials.values())
+        pending_orders = by_status["Pending"]
+        completed_orders = by_status["Completed"]
         
         # Get top performing staff
-        staff_performance = {}
-        for order in orders:
-            if order.staff_id not in staff_performance:
-                staff_performance[order.staff_id] = {'count': 0, 'total': 0, 'name': ''}
-            staff_performance[order.staff_id]['count'] += 1
-            staff_performance[order.staff_id]['total'] += order.total
-            if order.staff_member:
-                staff_performance[order.staff_id]['name'] = order.staff_member.name
+        staff_names = {s.id: s.name for s in Staff.query.filter(Staff.id.in_(list(staff_counts))).all()}
+        staff_performance = {
+            staff_id: {'count': count, 'total': staff_totals[staff_id], 'name': staff_names.get(staff_id, '')}
+            for staff_id, count in staff_counts.items()
+        }
         
         # Sort by total sales
         top_staff = sorted(staff_performance.items(), key=lambda x: x[1]['total'], reverse=True)[:5]
         
         # Get most ordered items
-        item_counts = {}
-        for order in orders:
-            for item in order.items:
-                menu_item = item.menu_item
-                if menu_item:
-                    if menu_item.id not in item_counts:
-                        item_counts[menu_item.id] = {'name': menu_item.name, 'count': 0, 'revenue': 0}
-                    item_counts[menu_item.id]['count'] += item.quantity
-                    item_counts[menu_item.id]['revenue'] += menu_item.price * item.quantity
+        menu_items = {m.id: m for m in MenuItem.query.filter(MenuItem.id.in_(list(item_counts))).all()}
+        item_stats = {
+            item_id: {'name': menu_items[item_id].name, 'count': count, 'revenue': menu_items[item_id].price * count}
+            for item_id, count in item_counts.items()
+            if item_id in menu_items
+        }
         
-        most_ordered = sorted(item_counts.items(), key=lambda x: x[1]['count'], reverse=True)[:5]
+        most_ordered = sorted(item_stats.items(), key=lambda x: x[1]['count'], reverse=True)[:5]
+        store_breakdown = [
+            (current_app.config["STORES"][code], part['totals']) for code, part in partials.items()
+        ]
         
         return render_template(
             "reports.html",
@@ -278,7 +450,8 @@ def register_routes(app, login_manager):
             pending_orders=pending_orders,
             completed_orders=completed_orders,
             top_staff=top_staff,
-            most_ordered=most_ordered
+            most_ordered=most_ordered,
+            store_breakdown=store_breakdown
         )
 
     # -------- STAFF --------
@@ -293,7 +466,8 @@ def register_routes(app, login_manager):
                 position=form.position.data,
                 contact=form.contact.data,
                 staff_id=form.staff_id.data or str(random.randint(100, 999)),
-                active=form.active.data
+                active=form.active.data,
+                store=current_store()
             )
             db.session.add(new_staff)
             db.session.commit()
@@ -301,15 +475,20 @@ def register_routes(app, login_manager):
             flash("Staff added", "success")
             return redirect(url_for("staff"))
 
-        staff_list = Staff.query.all()
+        staff_list = Staff.query.filter_by(store=current_store()).all()
         return render_template("staff.html", staff=staff_list, form=form)
 
     @app.route("/staff/delete/<int:id>", methods=["POST"])
     @login_required
     @require_role("admin", "manager")
     def delete_staff_route(id):
-        employee = Staff.query.get_or_404(id)
+        employee = Staff.query.filter_by(id=id, store=current_store()).first_or_404()
         emp_name = employee.name
+        # Orders live in every store's database, so check them all before deleting
+        order_counts = for_each_store(lambda code: Order.query.filter_by(staff_id=id).count())
+        if sum(order_counts.values()):
+            flash("Cannot delete a staff member who has orders. Mark them inactive instead.", "danger")
+            return redirect(url_for("staff"))
         db.session.delete(employee)
         db.session.commit()
         log_action("DELETE_STAFF", f"Deleted staff member: {emp_name}")
@@ -320,7 +499,7 @@ def register_routes(app, login_manager):
     @login_required
     @require_role("admin", "manager")
     def update_staff_route(id):
-        employee = Staff.query.get_or_404(id)
+        employee = Staff.query.filter_by(id=id, store=current_store()).first_or_404()
         employee.name = request.form.get("name")
         employee.position = request.form.get("position")
         employee.contact = request.form.get("contact")
@@ -335,7 +514,7 @@ def register_routes(app, login_manager):
     @login_required
     @require_role("admin", "manager")
     def edit_staff(id):
-        staff = Staff.query.get_or_404(id)
+        staff = Staff.query.filter_by(id=id, store=current_store()).first_or_404()
         
         if request.method == "POST":
             staff.name = request.form.get("name")
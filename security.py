@@ -0,0 +1,96 @@
+from concurrent.futures import ThreadPoolExecutor
+from threading import BoundedSemaphore, Lock
+import time
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+def hash_method(password_hash):
+    """Return the method prefix of a werkzeug hash, e.g. "scrypt:32768:8:1" """
+    return password_hash.split("$", 1)[0] if password_hash else None
+
+class TokenBucket:
+    """Per-key token buckets holding up to `burst` tokens refilled at `rate` per second"""
+
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = Lock()
+
+    def _refill(self, key, now):
+        tokens, stamp = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - stamp) * self.rate)
+
+    def consume(self, key):
+        """Take one token for key; return False if the bucket is empty"""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._refill(key, now)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return False
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return True
+
+    def refund(self, key):
+        """Give back a token, e.g. after a successful login"""
+        now = time.monotonic()
+        with self._lock:
+            self._buckets[key] = (min(self.burst, self._refill(key, now) + 1), now)
+
+    def _prune(self, now):
+        # Buckets that have refilled completely carry no state worth keeping
+        for key in [k for k in self._buckets if self._refill(k, now) >= self.burst]:
+            del self._buckets[key]
+
+class PasswordVerifier:
+    """Checks passwords on a small bounded pool so hashing cannot take every CPU.
+
+    At most `workers` hashes run at once and at most `queue` more wait; any
+    further attempt is turned away without hashing.
+    """
+
+    def __init__(self, method, workers=2, queue=8):
+        # Expand short forms like "scrypt" to the prefix werkzeug actually stores
+        self.method = hash_method(generate_password_hash("", method=method))
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hash")
+        self._slots = BoundedSemaphore(workers + queue)
+
+    def _check(self, password_hash, password):
+        if not check_password_hash(password_hash, password):
+            return False, None
+        if hash_method(password_hash) != self.method:
+            return True, self.hash(password)
+        return True, None
+
+    def hash(self, password):
+        """Hash a password with the configured parameters"""
+        return generate_password_hash(password, method=self.method)
+
+    def verify(self, password_hash, password):
+        """Return (ok, new_hash), or None if the pool is saturated.
+
+        new_hash is set when the stored hash used outdated parameters and
+        should be replaced.
+        """
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            return self._pool.submit(self._check, password_hash, password).result()
+        finally:
+            self._slots.release()
+
+def init_security(app):
+    """Create the login throttles and password verifier from app config"""
+    app.extensions["login_throttle"] = {
+        "user": TokenBucket(app.config["LOGIN_USER_RATE"], app.config["LOGIN_USER_BURST"]),
+        "ip": TokenBucket(app.config["LOGIN_IP_RATE"], app.config["LOGIN_IP_BURST"]),
+    }
+    app.extensions["password_verifier"] = PasswordVerifier(
+        app.config["PASSWORD_HASH_METHOD"],
+        workers=app.config["PASSWORD_HASH_WORKERS"],
+        queue=app.config["PASSWORD_HASH_QUEUE"],
+    )
@@ -77,8 +77,312 @@ document.addEventListener('DOMContentLoaded', function() {
             link.classList.add('active');
         }
     });
+    
+    // Queue new orders locally while the connection is down
+    const offlineOrderForm = document.querySelector('form[data-offline-queue]');
+    if (offlineOrderForm && window.indexedDB) {
+        initOfflineOrderQueue(offlineOrderForm);
+    }
 });
 
+/**
+ * Orders that could not reach the server, kept in IndexedDB until they are
+ * replayed in batches to the sync endpoint. The server deduplicates on
+ * client_key, so replaying an order twice never creates it twice.
+ */
+const OrderQueue = {
+    DB_NAME: 'kaufee',
+    STORE: 'pendingOrders',
+    BATCH_SIZE: 50,
+    syncing: false,
+    
+    open() {
+        if (!this.db) {
+            this.db = new Promise((resolve, reject) => {
+                const request = indexedDB.open(this.DB_NAME, 1);
+                request.onupgradeneeded = () => request.result.createObjectStore(this.STORE, { keyPath: 'client_key' });
+                request.onsuccess = () => resolve(request.result);
+                request.onerror = () => reject(request.error);
+            });
+        }
+        return this.db;
+    },
+    
+    async transaction(mode, fn) {
+        const db = await this.open();
+        return new Promise((resolve, reject) => {
+            const tx = db.transaction(this.STORE, mode);
+            const request = fn(tx.objectStore(this.STORE));
+            tx.oncomplete = () => resolve(request ? request.result : undefined);
+            tx.onerror = () => reject(tx.error);
+            tx.onabort = () => reject(tx.error);
+        });
+    },
+    
+    add(order) {
+        return this.transaction('readwrite', store => store.put(order));
+    },
+    
+    all() {
+        return this.transaction('readonly', store => store.getAll());
+    },
+    
+    remove(keys) {
+        return this.transaction('readwrite', store => {
+            keys.forEach(key => store.delete(key));
+        });
+    },
+    
+    /**
+     * Keep orders the server refused, with the reason, until the cashier fixes or drops them
+     * @param {Array<Object>} orders - The rejected orders
+     * @param {Object} reasons - Reason per client_key, or a single reason for all
+     */
+    reject(orders, reasons) {
+        return this.transaction('readwrite', store => {
+            orders.forEach(order => {
+                const reason = typeof reasons === 'string' ? reasons : reasons[order.client_key];
+                store.put(Object.assign({}, order, { rejected: reason || 'Rejected by the server' }));
+            });
+        });
+    },
+    
+    post(url, body) {
+        return fetch(url, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: {
+                'Content-Type': 'application/json',
+                'X-CSRFToken': document.querySelector('meta[name="csrf-token"]').content
+            },
+            body: JSON.stringify(body)
+        });
+    },
+    
+    /**
+     * Replace the page's CSRF token, which expires while a POS page stays open
+     * @param {string} url - The token endpoint
+     * @returns {Promise<boolean>} False if the session is gone and a login is needed
+     */
+    async refreshToken(url) {
+        const response = await fetch(url, { credentials: 'same-origin' });
+        if (!response.ok || !isJsonResponse(response)) return false;
+        document.querySelector('meta[name="csrf-token"]').content = (await response.json()).csrf_token;
+        return true;
+    },
+    
+    /**
+     * Send queued orders to the server, one request per batch
+     * @param {string} url - The sync endpoint
+     * @param {string} tokenUrl - The CSRF token endpoint
+     * @returns {Promise<Object>} Number of orders newly created, and whether the user must log in again
+     */
+    async sync(url, tokenUrl) {
+        const result = { created: 0, signedOut: false };
+        if (this.syncing || !navigator.onLine) return result;
+        this.syncing = true;
+        try {
+            // Each order is replayed into the store it was taken in
+            const byStore = {};
+            (await this.all()).filter(order => !order.rejected).forEach(order => {
+                (byStore[order.store] = byStore[order.store] || []).push(order);
+            });
+            
+            for (const [store, orders] of Object.entries(byStore)) {
+                for (let i = 0; i < orders.length; i += this.BATCH_SIZE) {
+                    const batch = orders.slice(i, i + this.BATCH_SIZE);
+                    const body = { store: store, orders: batch };
+                    let response = await this.post(url, body);
+                    // Flask-WTF rejects an expired or missing CSRF token with a 400 HTML page;
+                    // the endpoint's own errors are JSON
+                    if (response.status === 400 && !isJsonResponse(response)) {
+                        if (!(await this.refreshToken(tokenUrl))) {
+                            result.signedOut = true;
+                            return result;
+                        }
+                        response = await this.post(url, body);
+                    }
+                    // A login page instead of JSON means the session has ended
+                    if (response.ok && !isJsonResponse(response)) {
+                        result.signedOut = true;
+                        return result;
+                    }
+                    // The server refused the batch as a whole, e.g. a store that no longer exists
+                    if (response.status >= 400 && response.status < 500 && isJsonResponse(response)) {
+                        await this.reject(batch, (await response.json()).error);
+                        continue;
+                    }
+                    // Other failures only affect this batch; keep going with the rest
+                    if (!response.ok) continue;
+                    
+                    const results = (await response.json()).results;
+                    const keys = Object.keys(results);
+                    const synced = keys.filter(key => results[key].status !== 'invalid');
+                    const reasons = {};
+                    keys.filter(key => results[key].status === 'invalid').forEach(key => {
+                        reasons[key] = results[key].reason;
+                    });
+                    await this.remove(synced);
+                    await this.reject(batch.filter(order => order.client_key in reasons), reasons);
+                    result.created += keys.filter(key => results[key].status === 'created').length;
+                }
+            }
+        } catch (err) {
+            // Still offline; the next attempt picks up where this one stopped
+        } finally {
+            this.syncing = false;
+        }
+        return result;
+    }
+};
+
+/**
+ * Check whether a fetch response carries JSON
+ * @param {Response} response - The fetch response
+ * @returns {boolean} True for a JSON content type
+ */
+function isJsonResponse(response) {
+    return (response.headers.get('Content-Type') || '').includes('json');
+}
+
+/**
+ * Generate a random idempotency key for an order
+ * @returns {string} UUID v4 string
+ */
+function generateClientKey() {
+    // randomUUID is only available on HTTPS or localhost
+    if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+    
+    const bytes = crypto.getRandomValues(new Uint8Array(16));
+    bytes[6] = (bytes[6] & 0x0f) | 0x40;
+    bytes[8] = (bytes[8] & 0x3f) | 0x80;
+    const hex = Array.from(bytes, b => b.toString(16).padStart(2, '0')).join('');
+    return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
+}
+
+/**
+ * Submit the new order form normally, or queue the order when the server is unreachable
+ * @param {HTMLFormElement} form - The order form
+ */
+function initOfflineOrderQueue(form) {
+    const keyField = form.querySelector('[name="client_key"]');
+    const badge = document.getElementById('offlineQueueBadge');
+    const rejectedPanel = document.getElementById('rejectedOrders');
+    const modal = form.closest('.modal');
+    keyField.value = generateClientKey();
+    
+    async function refreshBadge() {
+        const orders = await OrderQueue.all();
+        const rejected = orders.filter(order => order.rejected);
+        if (badge) {
+            badge.querySelector('.count').textContent = orders.length - rejected.length;
+            badge.classList.toggle('d-none', orders.length === rejected.length);
+        }
+        if (rejectedPanel) renderRejected(rejected);
+    }
+    
+    // List refused orders so the cashier can correct them in the form or drop them
+    function renderRejected(orders) {
+        const list = rejectedPanel.querySelector('ul');
+        list.innerHTML = '';
+        orders.forEach(order => {
+            const item = document.createElement('li');
+            item.className = 'd-flex justify-content-between align-items-center mb-2';
+            const label = document.createElement('span');
+            label.textContent = `${order.customer_name || 'No name'}: ${order.rejected}`;
+            const actions = document.createElement('span');
+            
+            const edit = document.createElement('button');
+            edit.type = 'button';
+            edit.className = 'btn btn-sm btn-light me-2';
+            edit.textContent = 'Edit';
+            edit.addEventListener('click', () => editRejected(order));
+            
+            const drop = document.createElement('button');
+            drop.type = 'button';
+            drop.className = 'btn btn-sm btn-outline-light';
+            drop.textContent = 'Drop';
+            drop.addEventListener('click', async () => {
+                if (!confirm('Drop this order? It has not been recorded.')) return;
+                await OrderQueue.remove([order.client_key]);
+                await refreshBadge();
+            });
+            
+            actions.append(edit, drop);
+            item.append(label, actions);
+            list.appendChild(item);
+        });
+        rejectedPanel.classList.toggle('d-none', orders.length === 0);
+    }
+    
+    // Load a refused order into the form; it stays queued until it is submitted again
+    function editRejected(order) {
+        form.reset();
+        keyField.value = order.client_key;
+        form.querySelector('[name="customer_name"]').value = order.customer_name || '';
+        form.querySelector('[name="staff_id"]').value = order.staff_id;
+        const items = (order.menu_items || []).map(String);
+        Array.from(form.querySelector('[name="menu_items"]').options).forEach(option => {
+            option.selected = items.includes(option.value);
+        });
+        if (modal) bootstrap.Modal.getOrCreateInstance(modal).show();
+    }
+    
+    async function syncQueue() {
+        const result = await OrderQueue.sync(form.dataset.syncUrl, form.dataset.csrfUrl);
+        await refreshBadge();
+        // Show the synced orders, or the login page once the session has ended,
+        // unless someone is in the middle of entering an order
+        if ((result.created || result.signedOut) && !document.querySelector('.modal.show')) {
+            window.location.reload();
+        }
+    }
+    
+    form.addEventListener('submit', async function(e) {
+        e.preventDefault();
+        const data = new FormData(form);
+        let response;
+        try {
+            response = await fetch(form.action, {
+                method: 'POST',
+                body: data,
+                credentials: 'same-origin',
+                redirect: 'manual'
+            });
+        } catch (err) {
+            // Only a failed request means the server is unreachable
+            await OrderQueue.add({
+                client_key: data.get('client_key'),
+                store: form.dataset.store,
+                customer_name: data.get('customer_name'),
+                staff_id: data.get('staff_id'),
+                menu_items: data.getAll('menu_items'),
+                created_at: Date.now()
+            });
+            form.reset();
+            keyField.value = generateClientKey();
+            if (modal) bootstrap.Modal.getOrCreateInstance(modal).hide();
+            await refreshBadge();
+            return;
+        }
+        
+        if (response.type === 'opaqueredirect') {
+            // The order is recorded; drop any refused copy of it from the queue
+            await OrderQueue.remove([data.get('client_key')]);
+            window.location.href = form.action;
+            return;
+        }
+        // Let the server render validation and other errors; the same key prevents a duplicate.
+        // The form's "submit" button shadows form.submit, so call the prototype method.
+        HTMLFormElement.prototype.submit.call(form);
+    });
+    
+    window.addEventListener('online', syncQueue);
+    setInterval(syncQueue, 30000);
+    refreshBadge();
+    syncQueue();
+}
+
 /**
  * Format a number as currency
  * @param {number} value - The value to format
@@ -0,0 +1,131 @@
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy.session import Session
+import sqlalchemy as sa
+
+# Tables whose rows belong to a single branch and live in that branch's own
+# database. Everything else (users, menu, staff, audit log) stays in the
+# primary database shared by all branches.
+SHARDED_TABLES = {"order", "order_item"}
+
+DEFAULT_STORE = "main"
+
+def store_bind_key(code):
+    """Bind key under which a branch's order database is registered"""
+    return f"store_{code}"
+
+def store_binds(stores):
+    """Build SQLALCHEMY_BINDS entries giving each branch its own SQLite file"""
+    return {store_bind_key(code): f"sqlite:///store_{code}.db" for code in stores}
+
+def current_store():
+    """Return the code of the branch the current context is working on"""
+    stores = current_app.config["STORES"]
+    if "store" in g:
+        return g.store
+    if has_request_context() and session.get("store") in stores:
+        return session["store"]
+    return current_app.config["DEFAULT_STORE"]
+
+def _is_sharded(mapper, clause):
+    table = None
+    if mapper is not None:
+        table = sa.inspect(mapper).local_table
+    elif isinstance(clause, sa.Table):
+        table = clause
+    elif isinstance(clause, sa.UpdateBase) and isinstance(clause.table, sa.Table):
+        table = clause.table
+    return table is not None and table.name in SHARDED_TABLES
+
+class StoreSession(Session):
+    """Session that sends branch-owned tables to the current branch's database"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and _is_sharded(mapper, clause):
+            return self._db.engines[store_bind_key(current_store())]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def upgrade_tables(engine, tables):
+    """Add columns and indexes that existing SQLite tables are missing.
+
+    create_all() never alters a table that already exists, so databases
+    created by an older version are brought up to date here. Safe to run on
+    every start.
+    """
+    with engine.begin() as conn:
+        for table in tables:
+            existing = {row[1] for row in conn.exec_driver_sql(f'PRAGMA table_info("{table.name}")')}
+            if not existing:
+                continue
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column.type.compile(engine.dialect)}'
+                if column.default is not None and column.default.is_scalar:
+                    default = sa.literal(column.default.arg).compile(
+                        dialect=engine.dialect, compile_kwargs={"literal_binds": True}
+                    )
+                    ddl += f" NOT NULL DEFAULT {default}" if not column.nullable else f" DEFAULT {default}"
+                conn.exec_driver_sql(ddl)
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+def _move_legacy_orders(source, target, tables):
+    """Move orders kept in the primary database by older versions into a branch file"""
+    names = [t.name for t in tables]
+    if not sa.inspect(source).has_table(names[0]):
+        return
+    # Reflect what is really there, since old tables may lack newer columns
+    legacy = sa.MetaData()
+    legacy.reflect(
+        source, only=[n for n in names if sa.inspect(source).has_table(n)], resolve_fks=False
+    )
+    with source.connect() as conn:
+        # A non-empty target means an earlier move copied but did not clean up
+        with target.begin() as dst:
+            if not dst.execute(sa.select(sa.func.count()).select_from(tables[0])).scalar():
+                for table in tables:
+                    if table.name in legacy.tables:
+                        rows = [dict(r) for r in conn.execute(legacy.tables[table.name].select()).mappings()]
+                        if rows:
+                            dst.execute(table.insert(), rows)
+    # Drop only the order tables, never the shared tables they reference
+    with source.begin() as conn:
+        for name in reversed(names):
+            if name in legacy.tables:
+                legacy.tables[name].drop(conn)
+
+def init_stores(app, db):
+    """Create shared and branch tables and the worker pool used for fan-out queries"""
+    shared = [t for t in db.metadata.sorted_tables if t.name not in SHARDED_TABLES]
+    tables = [t for t in db.metadata.sorted_tables if t.name in SHARDED_TABLES]
+    db.metadata.create_all(db.engine, tables=shared)
+    upgrade_tables(db.engine, shared)
+    for code in app.config["STORES"]:
+        engine = db.engines[store_bind_key(code)]
+        db.metadata.create_all(engine, tables=tables)
+        upgrade_tables(engine, tables)
+
+    _move_legacy_orders(db.engine, db.engines[store_bind_key(app.config["DEFAULT_STORE"])], tables)
+
+    workers = app.config.get("STORE_WORKERS") or len(app.config["STORES"])
+    app.extensions["store_pool"] = ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="store"
+    )
+
+def for_each_store(fn):
+    """Run fn(code) for every branch in parallel and return {code: result}.
+
+    Each call gets its own app context, and with it its own session, so
+    results must be plain values rather than ORM objects.
+    """
+    app = current_app._get_current_object()
+    codes = list(app.config["STORES"])
+
+    def run(code):
+        with app.app_context():
+            g.store = code
+            return fn(code)
+
+    pool = app.extensions["store_pool"]
+    return dict(zip(codes, pool.map(run, codes)))